@@ -1,21 +1,98 @@
-import boto3
+import aioboto3
 import json
 import logging
 import os
+import random
 import time
 from datetime import datetime, timedelta
 import asyncio
-from openpyxl import Workbook
+import xlsxwriter
 import tempfile
-from botocore.exceptions import ClientError
+import operator
+from boto3.s3.transfer import TransferConfig
+from aiobotocore.config import AioConfig
+from botocore.exceptions import BotoCoreError, ClientError
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-MAX_RETRIES = 5
+MAX_RETRIES = 3  # Outer retries; each one already includes botocore's own attempts
 RETRY_SLEEP = 1
-MAX_CONCURRENT_TASKS = 10
-BATCH_SIZE = 500
+MAX_CONCURRENT_TASKS = 10  # Batch consumers, and so the most GetMetricData calls in flight
+ADMISSION_RECOVERY_SUCCESSES = 20  # Successful calls before concurrency is raised again
+MAX_METRIC_QUERIES = 500  # GetMetricData limit per request
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+
+# Pool sized above the concurrency limit so coroutines never queue on connection checkout
+BOTO_CONFIG = AioConfig(
+    max_pool_connections=MAX_CONCURRENT_TASKS * 2,
+    retries={"mode": "adaptive", "max_attempts": 3},  # Token-bucket rate limiting on throttles
+    connect_timeout=5,
+    read_timeout=15,
+)
+
+# Reused across invocations of a warm container
+session = aioboto3.Session()
+
+# (report column, CloudWatch metric, statistic) collected for every function
+METRIC_QUERIES = [
+    ("Invocations", "Invocations", "Sum"),
+    ("Errors", "Errors", "Sum"),
+    ("Throttles", "Throttles", "Sum"),
+    ("Duration (sec)", "Duration", "Average"),
+    ("ConcurrentExecutions", "ConcurrentExecutions", "Maximum"),  # Gauge: peak, not total
+]
+
+# Every insight dict carries exactly these keys, in report column order
+REPORT_HEADERS = (
+    "Function Name",
+    "Runtime",
+    "Memory Size (MB)",
+    "Timeout (sec)",
+    "Package Type",
+    "Provisioned Concurrency",
+    "Cold Start Risk",
+) + tuple(column for column, _, _ in METRIC_QUERIES)
+get_report_row = operator.itemgetter(*REPORT_HEADERS)
+
+# Concurrency limit that shrinks on throttling and grows back after sustained success
+class AdmissionController:
+    def __init__(self, max_concurrency):
+        self.in_flight = 0
+        self.limit = max_concurrency
+        self.ceiling = max_concurrency
+        self.successes = 0
+        self.cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self):
+        async with self.cond:
+            self.in_flight -= 1
+            self.cond.notify(1)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release()
+
+    async def throttled(self):
+        async with self.cond:
+            self.limit = max(1, self.limit // 2)  # Multiplicative decrease, additive recovery
+            self.successes = 0
+
+    async def succeeded(self):
+        async with self.cond:
+            self.successes += 1
+            if self.successes >= ADMISSION_RECOVERY_SUCCESSES and self.limit < self.ceiling:
+                self.limit += 1
+                self.successes = 0
+                self.cond.notify_all()
 
 def lambda_handler(event, context):
     return asyncio.run(handle_event(event, context))
@@ -38,10 +115,6 @@ async def handle_event(event, context):
         if not all([region, start_date, end_date, bucket_name]):
             return build_response(400, {"error": "Missing one or more required fields in request body."})
 
-        lambda_client = boto3.client("lambda", region_name=region)
-        cloudwatch = boto3.client("cloudwatch", region_name=region)
-        s3 = boto3.client("s3", region_name=region)
-
         # Ensure the end_date is strictly after the start_date
         start_time = datetime.strptime(start_date, "%Y-%m-%d")
         end_time = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)
@@ -50,31 +123,11 @@ async def handle_event(event, context):
             logger.error(f"Invalid date range: Start date {start_time} must be before End date {end_time}")
             return build_response(400, {"error": "Start date must be before end date."})
 
-        # Fetch all Lambda functions
-        paginator = lambda_client.get_paginator("list_functions")
-        all_functions = [fn for page in paginator.paginate() for fn in page['Functions']]
-
-        logger.info(f"Total functions fetched: {len(all_functions)}")
-
-        # Process functions in smaller batches with a limit on concurrent tasks
-        insights = await analyze_functions_in_batches(all_functions, lambda_client, cloudwatch, s3, start_time, end_time, bucket_name)
+        file_key = await generate_report(region, start_time, end_time, bucket_name)
 
-        if not insights:
+        if not file_key:
             return {"statusCode": 500, "body": "No function metrics collected."}
 
-        # Write to Excel
-        workbook = Workbook()
-        sheet = workbook.active
-        headers = list(insights[0].keys())
-        sheet.append(headers)
-        for item in insights:
-            sheet.append([item.get(h, '') for h in headers])
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-            workbook.save(tmp.name)
-            file_key = f"lambda-insights-report-{datetime.now().strftime('%Y%m%d%H%M%S')}.xlsx"
-            await asyncio.to_thread(s3.upload_file, tmp.name, bucket_name, file_key)
-
         # Construct the HTTPS link
         file_url = f"https://{bucket_name}.s3.{region}.amazonaws.com/{file_key}"
 
@@ -90,78 +143,189 @@ async def handle_event(event, context):
         logger.error(f"Unhandled exception: {str(e)}")
         return build_response(500, {"error": "Internal server error."})
 
-async def analyze_functions_in_batches(all_functions, lambda_client, cloudwatch, s3, start_time, end_time, bucket_name):
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_TASKS)
-    insights = []
-    tasks = []
-    
-    # Process functions in smaller batches
-    for i in range(0, len(all_functions), BATCH_SIZE):
-        batch = all_functions[i:i + BATCH_SIZE]
-        for fn in batch:
-            tasks.append(analyze_function(fn, lambda_client, cloudwatch, s3, start_time, end_time, bucket_name, semaphore))
-        
-        results = await asyncio.gather(*tasks)
-        insights.extend(filter(None, results))  # Add successful results to insights
-        tasks.clear()  # Clear the tasks list to process the next batch
-
-    return insights
-
-async def analyze_function(fn, lambda_client, cloudwatch, s3, start_time, end_time, bucket_name, semaphore):
-    async with semaphore:  # Limit concurrent execution
-        name = fn['FunctionName']
-        try:
-            config = await asyncio.to_thread(lambda_client.get_function_configuration, FunctionName=name)
-        except ClientError as e:
-            logger.error(f"[{name}] Configuration fetch failed: {e}")
+async def generate_report(region, start_time, end_time, bucket_name):
+    async with session.client("lambda", region_name=region, config=BOTO_CONFIG) as lambda_client, \
+            session.client("cloudwatch", region_name=region, config=BOTO_CONFIG) as cloudwatch, \
+            session.client("s3", region_name=region, config=BOTO_CONFIG) as s3:
+        admission = AdmissionController(MAX_CONCURRENT_TASKS)
+        # Bounded so discovery pauses when analysis falls behind; only queue-depth batches are held
+        queue = asyncio.Queue(maxsize=MAX_CONCURRENT_TASKS)
+        insights = []
+
+        # Discover functions page by page while earlier pages are already being analyzed.
+        # One consumer per admission slot, so the controller's limit is the real fan-out.
+        await asyncio.gather(
+            produce_function_batches(lambda_client, queue, MAX_CONCURRENT_TASKS),
+            *[consume_function_batches(queue, cloudwatch, start_time, end_time, admission, insights)
+              for _ in range(MAX_CONCURRENT_TASKS)]
+        )
+
+        logger.info(f"Total functions analyzed: {len(insights)}")
+
+        if not insights:
             return None
 
-        memory = config.get("MemorySize", 0)
-        runtime = config.get("Runtime", "unknown")
-        arch = config.get("Architectures", ["x86_64"])[0]
-        cold_start_risk = "High" if memory < 256 or runtime.startswith("java") or arch == "arm64" else "Low"
-
-        metrics = {
-            "Invocations": await get_metric(name, "Invocations", "Sum", cloudwatch, start_time, end_time),
-            "Errors": await get_metric(name, "Errors", "Sum", cloudwatch, start_time, end_time),
-            "Throttles": await get_metric(name, "Throttles", "Sum", cloudwatch, start_time, end_time),
-            "Duration (sec)": round(await get_metric(name, "Duration", "Average", cloudwatch, start_time, end_time) / 1000, 2),
-            "ConcurrentExecutions": await get_metric(name, "ConcurrentExecutions", "Sum", cloudwatch, start_time, end_time),
-        }
+        # Consumers finish in any order; sort so repeated runs give identically ordered sheets
+        insights.sort(key=operator.itemgetter("Function Name"))
 
-        return {
-            "Function Name": name,
-            "Runtime": runtime,
-            "Memory Size (MB)": memory,
-            "Timeout (sec)": config.get("Timeout", 0),
-            "Package Type": config.get("PackageType", "Zip"),
-            "Provisioned Concurrency": config.get("ProvisionedConcurrencyConfig", {}).get(
-                "AllocatedProvisionedConcurrentExecutions", 0),
-            "Cold Start Risk": cold_start_risk,
-            **metrics
-        }
+        # Assemble the whole sheet as a 2D list, then write it in a single pass
+        rows = list(map(get_report_row, insights))
+        file_key = f"lambda-insights-report-{datetime.now().strftime('%Y%m%d%H%M%S')}.xlsx"
+        transfer_config = TransferConfig(multipart_threshold=MULTIPART_THRESHOLD)
+
+        # The zip is assembled in an anonymous /tmp file (deleted on close) and read back
+        # in parts for the upload, so the finished workbook is never held in RAM
+        with tempfile.TemporaryFile(suffix=".xlsx") as report_file:
+            build_workbook([REPORT_HEADERS] + rows, report_file)
+            await s3.upload_fileobj(report_file, bucket_name, file_key, Config=transfer_config)
+
+        return file_key
+
+def build_workbook(rows, report_file, sheet_name="Insights"):
+    # constant_memory flushes each row to xlsxwriter's own /tmp staging files, so rows must go in order
+    workbook = xlsxwriter.Workbook(report_file, {"constant_memory": True})
+    write_row = workbook.add_worksheet(sheet_name).write_row
+    for i, row in enumerate(rows):
+        write_row(i, 0, row)
+    workbook.close()
+    report_file.seek(0)
+
+async def produce_function_batches(lambda_client, queue, consumers):
+    # Each batch holds just enough functions to fill one GetMetricData request
+    batch_size = MAX_METRIC_QUERIES // len(METRIC_QUERIES)
+    batch = []
+    try:
+        paginator = lambda_client.get_paginator("list_functions")
+        async for page in paginator.paginate():
+            batch.extend(page['Functions'])
+            while len(batch) >= batch_size:
+                await queue.put(batch[:batch_size])
+                batch = batch[batch_size:]
+        if batch:
+            await queue.put(batch)
+    finally:
+        # Always release the consumers, even if pagination fails
+        for _ in range(consumers):
+            await queue.put(None)
+
+async def consume_function_batches(queue, cloudwatch, start_time, end_time, admission, insights):
+    # Raw list_functions entries are dropped once analyzed; only the compact insight rows are kept
+    while (batch := await queue.get()) is not None:
+        metrics = await fetch_all_metrics([fn['FunctionName'] for fn in batch], cloudwatch, start_time, end_time, admission)
+        insights.extend(analyze_functions(batch, metrics))
+
+def analyze_functions(all_functions, metrics):
+    return [analyze_function(fn, metrics) for fn in all_functions]
+
+def analyze_function(fn, metrics):
+    # list_functions already returns the configuration fields the report needs
+    name = fn['FunctionName']
+    memory = fn.get("MemorySize", 0)
+    runtime = fn.get("Runtime", "unknown")
+    arch = fn.get("Architectures", ["x86_64"])[0]
+    cold_start_risk = "High" if memory < 256 or runtime.startswith("java") or arch == "arm64" else "Low"
+
+    fn_metrics = metrics.get(name, {})
+
+    return {
+        "Function Name": name,
+        "Runtime": runtime,
+        "Memory Size (MB)": memory,
+        "Timeout (sec)": fn.get("Timeout", 0),
+        "Package Type": fn.get("PackageType", "Zip"),
+        "Provisioned Concurrency": fn.get("ProvisionedConcurrencyConfig", {}).get(
+            "AllocatedProvisionedConcurrentExecutions", 0),
+        "Cold Start Risk": cold_start_risk,
+        # Metrics that could not be fetched stay blank rather than looking like zero traffic
+        **{column: fn_metrics.get(column, '') for column, _, _ in METRIC_QUERIES}
+    }
+
+async def fetch_all_metrics(function_names, cloudwatch, start_time, end_time, admission):
+    # One query per (function, metric); the query Id maps each result back to its cell.
+    # A single period spanning the whole (day-aligned) range gives one exact Sum/Average/Maximum per query.
+    period = int((end_time - start_time).total_seconds())
+    queries = []
+    targets = {}
+    for fn_name in function_names:
+        for column, metric_name, stat in METRIC_QUERIES:
+            query_id = f"m{len(queries)}"
+            targets[query_id] = (fn_name, column, stat)
+            queries.append({
+                "Id": query_id,
+                "MetricStat": {
+                    "Metric": {
+                        "Namespace": "AWS/Lambda",
+                        "MetricName": metric_name,
+                        "Dimensions": [{"Name": "FunctionName", "Value": fn_name}],
+                    },
+                    "Period": period,
+                    "Stat": stat,
+                },
+                "ReturnData": True,
+            })
+
+    chunks = [queries[i:i + MAX_METRIC_QUERIES] for i in range(0, len(queries), MAX_METRIC_QUERIES)]
+    results = await asyncio.gather(*[
+        get_metric_data(chunk, cloudwatch, start_time, end_time, admission) for chunk in chunks
+    ])
+
+    metrics = {fn_name: {} for fn_name in function_names}
+    for values_by_id in results:
+        for query_id, values in values_by_id.items():
+            fn_name, column, stat = targets[query_id]
+            metrics[fn_name][column] = aggregate_metric(values, stat)
+
+    for fn_metrics in metrics.values():
+        if "Duration (sec)" in fn_metrics:
+            fn_metrics["Duration (sec)"] = round(fn_metrics["Duration (sec)"] / 1000, 2)
+
+    return metrics
+
+async def get_metric_data(queries, cloudwatch, start_time, end_time, admission):
+    values_by_id = {}
+    next_token = None
+    while True:
+        kwargs = {"NextToken": next_token} if next_token else {}
+        for attempt in range(MAX_RETRIES):
+            try:
+                async with admission:
+                    response = await cloudwatch.get_metric_data(MetricDataQueries=queries,
+                                                                StartTime=start_time,
+                                                                EndTime=end_time,
+                                                                **kwargs)
+                await admission.succeeded()
+                break
+            except (ClientError, BotoCoreError) as e:
+                # Timeouts and connection errors are BotoCoreErrors; they blank this batch, not the report
+                if isinstance(e, ClientError) and e.response['Error']['Code'] == 'Throttling':
+                    await admission.throttled()  # Back off concurrency, not just this call
+                    # Full jitter keeps throttled coroutines from retrying in lockstep
+                    await asyncio.sleep(random.uniform(0, RETRY_SLEEP * (1 << attempt)))
+                else:
+                    # Discard partial pages too; unfetched metrics are left blank in the report
+                    logger.error(f"GetMetricData error for {len(queries)} queries, leaving their cells empty: {e}")
+                    return {}
+        else:
+            logger.warning(f"Max retries exceeded for GetMetricData ({len(queries)} queries), leaving their cells empty")
+            return {}
+
+        # Results may be split across pages, so extend rather than overwrite
+        for result in response.get("MetricDataResults", []):
+            values_by_id.setdefault(result["Id"], []).extend(result.get("Values", []))
+
+        next_token = response.get("NextToken")
+        if not next_token:
+            return values_by_id
 
-async def get_metric(fn_name, metric_name, stat, cloudwatch, start_time, end_time):
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = await asyncio.to_thread(cloudwatch.get_metric_statistics,
-                                                Namespace="AWS/Lambda",
-                                                MetricName=metric_name,
-                                                Dimensions=[{"Name": "FunctionName", "Value": fn_name}],
-                                                StartTime=start_time,
-                                                EndTime=end_time,
-                                                Period=3600,
-                                                Statistics=[stat])
-            datapoints = response.get("Datapoints", [])
-            return datapoints[0][stat] if datapoints else 0
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'Throttling':
-                await asyncio.sleep(RETRY_SLEEP * (2 ** attempt))
-            else:
-                logger.error(f"[{fn_name}] Metric {metric_name} error: {e}")
-                return 0
-    logger.warning(f"[{fn_name}] Max retries exceeded for metric {metric_name}")
-    return 0
+def aggregate_metric(values, stat):
+    # Each query spans the whole range, so this is normally a single value
+    if not values:
+        return 0
+    if stat == "Sum":
+        return sum(values)
+    if stat == "Maximum":
+        return max(values)
+    return sum(values) / len(values)
 
 def build_response(status_code, body):
     return {
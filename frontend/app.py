@@ -1,7 +1,13 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 import numpy as np
+import io
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+MAX_BARS = 50  # Larger selections plot only the top functions per metric
 
 # Page setup
 st.set_page_config(page_title="Lambda Report Dashboard", layout="wide")
@@ -12,7 +18,54 @@ uploaded_file = st.file_uploader("📂 Upload Excel Report", type=["xlsx"])
 
 @st.cache_data
 def load_data(file):
-    return pd.read_excel(file)
+    # calamine is a Rust-backed reader, much faster and leaner than openpyxl
+    df = pd.read_excel(file, engine="calamine")
+
+    # Downcast numbers (whole-valued floats become integers) to shrink memory and chart payloads
+    for col in df.select_dtypes(include=["float64"]).columns:
+        is_whole = df[col].dropna().mod(1).eq(0).all()
+        downcast = pd.to_numeric(df[col], downcast="integer") if is_whole else df[col]
+        # Integer downcast is a no-op when the column has NaN, so narrow the floats instead
+        if downcast.dtype == "float64":
+            downcast = pd.to_numeric(df[col], downcast="float")
+        df[col] = downcast
+    for col in df.select_dtypes(include=["int64"]).columns:
+        df[col] = pd.to_numeric(df[col], downcast="integer")
+
+    if "Function Name" in df.columns:
+        df["Function Name"] = df["Function Name"].astype("category")
+    return df
+
+# Figures and stats are cached on their inputs so reruns from unrelated widgets skip the rebuild
+@st.cache_data(max_entries=32)
+def make_bar(filtered_df, metric):
+    plot_df = filtered_df.nlargest(MAX_BARS, metric) if len(filtered_df) > MAX_BARS else filtered_df
+    # One trace colored by category code, instead of one trace per function
+    fig = go.Figure(go.Bar(
+        x=plot_df["Function Name"],
+        y=plot_df[metric],
+        marker=dict(color=plot_df["Function Name"].cat.codes, colorscale="Viridis"),  # To distinguish different functions by color
+        hovertemplate="Function Name: %{x}<br>" + metric + ": %{y}<extra></extra>"  # Show details on hover
+    ))
+    fig.update_layout(
+        title=f"{metric} by Lambda Function",
+        xaxis_title="Lambda Function",
+        yaxis_title=metric
+    )
+    return fig
+
+@st.cache_data(max_entries=32)
+def to_csv_bytes(filtered_df):
+    # pyarrow writes the CSV in C++ straight into a bytes buffer, with no intermediate Python string
+    buffer = io.BytesIO()
+    pa_csv.write_csv(pa.Table.from_pandas(filtered_df, preserve_index=False), buffer)
+    return buffer.getvalue()
+
+@st.cache_data(max_entries=32)
+def summarize(filtered_df, metrics):
+    summary_stats = filtered_df[list(metrics)].describe().T
+    summary_stats['range'] = summary_stats['max'] - summary_stats['min']
+    return summary_stats
 
 if uploaded_file:
     try:
@@ -43,29 +96,21 @@ if uploaded_file:
                 st.warning("Please select at least one Lambda function for comparison.")
             else:
                 # Filter data for selected functions
-                filtered_df = df[df["Function Name"].isin(selected_functions)]
+                filtered_df = df[df["Function Name"].isin(selected_functions)].copy()
+                filtered_df["Function Name"] = filtered_df["Function Name"].cat.remove_unused_categories()
 
                 if filtered_df.empty:
                     st.warning("No data available for the selected functions.")
                 else:
                     # Show statistics for selected metric(s)
                     st.markdown("### 🧮 Summary Statistics")
-                    summary_stats = filtered_df[selected_metrics].describe().T
-                    summary_stats['range'] = summary_stats['max'] - summary_stats['min']
-                    st.dataframe(summary_stats)
+                    st.dataframe(summarize(filtered_df, tuple(selected_metrics)))
 
                     # Plot bar chart with selected functions for comparison
                     for metric in selected_metrics:
-                        fig = px.bar(
-                            filtered_df,
-                            x="Function Name",
-                            y=metric,
-                            title=f"{metric} by Lambda Function",
-                            labels={"Function Name": "Lambda Function", metric: metric},
-                            color="Function Name",  # To distinguish different functions by color
-                            barmode="group",  # Display bars next to each other for comparison
-                            hover_data=["Function Name", metric]  # Show details on hover
-                        )
+                        fig = make_bar(filtered_df, metric)
+                        if len(filtered_df) > MAX_BARS:
+                            st.caption(f"Showing the top {MAX_BARS} of {len(filtered_df)} functions by {metric}.")
                         st.plotly_chart(fig, use_container_width=True)
 
                     # Add scatter plot option for comparison
@@ -84,10 +129,9 @@ if uploaded_file:
 
                     # Export the filtered data as CSV
                     st.markdown("### 📤 Export Data")
-                    csv = filtered_df.to_csv(index=False)
                     st.download_button(
                         label="Download Data as CSV",
-                        data=csv,
+                        data=to_csv_bytes(filtered_df),
                         file_name="filtered_lambda_data.csv",
                         mime="text/csv"
                     )